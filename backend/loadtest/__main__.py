@@ -0,0 +1,467 @@
+"""
+Load test the backend against local stand-ins of the Aleph API and of the IPFS API
+
+Usage (from the backend directory): python -m loadtest --help
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import math
+import os
+import secrets
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import AsyncIterator, Awaitable
+
+import aiohttp
+from ecies import decrypt
+from ecies.utils import generate_eth_key
+
+from loadtest.stand_in import StandInConfig, get_state, start_stand_in
+
+BACKEND_DIRECTORY = Path(__file__).parent.parent
+AGENT_POST_TYPE = "libertai-agent"
+FILE_CHUNK_SIZE = 1024 * 1024  # 1MB
+
+
+@dataclass
+class PhaseResult:
+    name: str
+    latencies: list[float] = field(default_factory=list)
+    errors: Counter = field(default_factory=Counter)
+    peak_rss: int = 0
+    upstream_calls: Counter = field(default_factory=Counter)
+    upstream_bytes: int = 0
+    duration: float = 0.0
+
+    @property
+    def requests(self) -> int:
+        return len(self.latencies) + sum(self.errors.values())
+
+    def summary(self) -> dict:
+        requests = max(self.requests, 1)
+        return {
+            "phase": self.name,
+            "requests": self.requests,
+            "errors": dict(self.errors),
+            "throughput_rps": round(self.requests / self.duration, 2)
+            if self.duration
+            else None,
+            "latency_ms": latency_percentiles(self.latencies),
+            "backend_peak_rss_mb": round(self.peak_rss / 1024 / 1024, 1),
+            "upstream_calls_per_request": {
+                call: round(count / requests, 2)
+                for call, count in sorted(self.upstream_calls.items())
+            },
+            "upstream_mb_per_request": round(
+                self.upstream_bytes / requests / 1024 / 1024, 2
+            ),
+        }
+
+
+def percentile(values: list[float], value: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    index = max(math.ceil(value / 100 * len(ordered)) - 1, 0)
+    return ordered[index]
+
+
+def latency_percentiles(latencies: list[float]) -> dict[str, float] | None:
+    """Percentiles of latencies given in seconds, in milliseconds"""
+    if len(latencies) == 0:
+        return None
+    return {
+        name: round(percentile(latencies, value) * 1000, 1)
+        for name, value in [("p50", 50), ("p90", 90), ("p99", 99), ("max", 100)]
+    }
+
+
+def parse_size(size: str) -> int:
+    units = {"KB": 1024, "MB": 1024**2, "GB": 1024**3}
+    for unit, multiplier in units.items():
+        if size.upper().endswith(unit):
+            return int(float(size[: -len(unit)]) * multiplier)
+    return int(size)
+
+
+def read_rss(pid: int) -> int:
+    """Current resident memory of a process in bytes (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except FileNotFoundError:
+        pass
+    return 0
+
+
+async def sample_rss(pid: int, result: PhaseResult, interval: float = 0.02) -> None:
+    while True:
+        result.peak_rss = max(result.peak_rss, read_rss(pid))
+        await asyncio.sleep(interval)
+
+
+async def stream_file(path: Path, prefix: bytes) -> AsyncIterator[bytes]:
+    """Stream a file with a unique prefix, so that every upload has a different content"""
+    yield prefix
+    with open(path, "rb") as file:
+        while chunk := file.read(FILE_CHUNK_SIZE):
+            yield chunk
+
+
+def create_archive(directory: str, size: int) -> Path:
+    path = Path(directory) / f"archive-{size}"
+    with open(path, "wb") as file:
+        remaining = size
+        while remaining > 0:
+            chunk_size = min(remaining, FILE_CHUNK_SIZE)
+            file.write(os.urandom(chunk_size))
+            remaining -= chunk_size
+    return path
+
+
+async def run_phase(
+    name: str, pid: int, stand_in_app, requests: Awaitable[list]
+) -> PhaseResult:
+    """Run the requests of a phase, collecting latencies, backend memory and upstream calls"""
+    result = PhaseResult(name=name)
+    stand_in_state = get_state(stand_in_app)
+    stand_in_state.reset_counters()
+    sampler = asyncio.create_task(sample_rss(pid, result))
+    start = time.perf_counter()
+
+    outcomes = await requests
+
+    result.duration = time.perf_counter() - start
+    sampler.cancel()
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            result.errors[type(outcome).__name__] += 1
+        elif isinstance(outcome, str):
+            result.errors[outcome] += 1
+        else:
+            result.latencies.append(outcome)
+    result.upstream_calls = Counter(stand_in_state.calls)
+    result.upstream_bytes = stand_in_state.received_bytes
+    return result
+
+
+async def setup_agent(
+    session: aiohttp.ClientSession, backend_url: str, password: str, index: int
+) -> float | str:
+    start = time.perf_counter()
+    async with session.post(
+        f"{backend_url}/agent",
+        json={
+            "subscription_id": f"loadtest-{index}",
+            "password": password,
+            "account": {
+                "address": "0x0000000000000000000000000000000000000000",
+                "chain": "base",
+            },
+        },
+    ) as response:
+        await response.read()
+        if response.status != 200:
+            return f"HTTP {response.status}"
+    return time.perf_counter() - start
+
+
+@dataclass
+class DeployScenario:
+    backend_url: str
+    code_path: Path
+    packages_path: Path
+    # Send the same archives every time instead of unique ones
+    reuse_archives: bool
+    accept_latencies: list[float] = field(default_factory=list)
+
+
+async def deploy_agent(
+    session: aiohttp.ClientSession, scenario: DeployScenario, agent: dict
+) -> float | str:
+    """Deploy an agent and wait for the end of its deploy job"""
+    start = time.perf_counter()
+    # A unique prefix makes every upload different
+    prefix = b"" if scenario.reuse_archives else secrets.token_bytes(32)
+    form_data = aiohttp.FormData()
+    form_data.add_field("agent_id", agent["id"])
+    form_data.add_field("secret", agent["secret"])
+    form_data.add_field(
+        "code", stream_file(scenario.code_path, prefix), filename="code.squashfs"
+    )
+    form_data.add_field(
+        "packages",
+        stream_file(scenario.packages_path, prefix),
+        filename="packages.squashfs",
+    )
+
+    async with session.put(f"{scenario.backend_url}/agent", data=form_data) as response:
+        if response.status != 200:
+            return f"HTTP {response.status}"
+        body = await response.json()
+    scenario.accept_latencies.append(time.perf_counter() - start)
+
+    while True:
+        async with session.get(
+            f"{scenario.backend_url}/agent/deploy/{body['job_id']}"
+        ) as response:
+            job = await response.json()
+        if job["status"] == "completed":
+            return time.perf_counter() - start
+        if job["status"] == "failed":
+            return "Deploy job failed"
+        await asyncio.sleep(0.05)
+
+
+async def deploy_worker(
+    session: aiohttp.ClientSession, scenario: DeployScenario, agent: dict, requests: int
+) -> list[float | str]:
+    """Deploy the same agent several times in a row (deploys of an agent can't overlap)"""
+    outcomes: list[float | str] = []
+    for _ in range(requests):
+        try:
+            outcome = await deploy_agent(session, scenario, agent)
+        except Exception as error:
+            outcome = type(error).__name__
+        outcomes.append(outcome)
+    return outcomes
+
+
+async def deploy_agents(
+    session: aiohttp.ClientSession,
+    scenario: DeployScenario,
+    agents: list[dict],
+    requests: int,
+) -> list[float | str]:
+    """Deploy all the agents in parallel"""
+    requests_per_agent = math.ceil(requests / len(agents))
+    results = await asyncio.gather(
+        *[
+            deploy_worker(session, scenario, agent, requests_per_agent)
+            for agent in agents
+        ]
+    )
+    return [outcome for worker_outcomes in results for outcome in worker_outcomes]
+
+
+def fetch_created_agents(stand_in_app, sender_sk: str) -> list[dict]:
+    """Read the agents created by the backend on the stand-in and decrypt their secrets"""
+    agents = []
+    for message in get_state(stand_in_app).messages.values():
+        if message["type"] != "POST" or message["content"]["type"] != AGENT_POST_TYPE:
+            continue
+        agent = message["content"]["content"]
+        encrypted_secret = base64.b64decode(agent["encrypted_secret"])
+        agents.append(
+            {"id": agent["id"], "secret": decrypt(sender_sk, encrypted_secret).decode()}
+        )
+    return agents
+
+
+async def wait_for_backend(
+    session: aiohttp.ClientSession, backend_url: str, process: subprocess.Popen
+) -> None:
+    for _ in range(200):
+        if process.poll() is not None:
+            raise RuntimeError("Backend exited during startup")
+        try:
+            async with session.get(f"{backend_url}/openapi.json") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientConnectionError:
+            pass
+        await asyncio.sleep(0.1)
+    raise TimeoutError("Backend didn't start in time")
+
+
+async def main(args: argparse.Namespace) -> list[dict]:
+    stand_in_config = StandInConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        failure_rate=args.failure_rate,
+        upload_bandwidth=parse_size(args.upload_bandwidth),
+    )
+    stand_in_runner, stand_in_app = await start_stand_in(
+        stand_in_config, args.stand_in_port
+    )
+    stand_in_url = f"http://127.0.0.1:{args.stand_in_port}"
+    backend_url = f"http://127.0.0.1:{args.backend_port}"
+
+    sender_key = generate_eth_key()
+    password = secrets.token_hex(16)
+    environment = {
+        **os.environ,
+        "ALEPH_API_URL": stand_in_url,
+        "IPFS_API_URL": stand_in_url,
+        "ALEPH_SENDER": sender_key.public_key.to_checksum_address(),
+        "ALEPH_SENDER_SK": sender_key.to_hex(),
+        "ALEPH_SENDER_PK": sender_key.public_key.to_hex(),
+        "ALEPH_AGENT_POST_TYPE": AGENT_POST_TYPE,
+        "SUBSCRIPTION_BACKEND_PASSWORD": password,
+        "MAX_CONCURRENT_DEPLOYS": str(args.max_concurrent_deploys),
+        "MAX_QUEUED_DEPLOYS": str(args.max_queued_deploys),
+    }
+    backend = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "src.main:app",
+            "--port",
+            str(args.backend_port),
+            "--log-level",
+            "warning",
+        ],
+        cwd=BACKEND_DIRECTORY,
+        env=environment,
+    )
+
+    summaries = []
+    try:
+        timeout = aiohttp.ClientTimeout(total=None)
+        connector = aiohttp.TCPConnector(limit=args.concurrency * 2)
+        async with aiohttp.ClientSession(
+            timeout=timeout, connector=connector
+        ) as session:
+            await wait_for_backend(session, backend_url, backend)
+
+            setup_result = await run_phase(
+                "POST /agent",
+                backend.pid,
+                stand_in_app,
+                asyncio.gather(
+                    *[
+                        setup_agent(session, backend_url, password, index)
+                        for index in range(args.concurrency)
+                    ],
+                    return_exceptions=True,
+                ),
+            )
+            summaries.append(setup_result.summary())
+            agents = fetch_created_agents(stand_in_app, sender_key.to_hex())
+            if len(agents) == 0:
+                raise RuntimeError("No agent could be created")
+
+            with tempfile.TemporaryDirectory() as directory:
+                code_path = create_archive(directory, parse_size(args.code_size))
+                for packages_size in args.packages_sizes.split(","):
+                    packages_path = create_archive(directory, parse_size(packages_size))
+                    scenario = DeployScenario(
+                        backend_url=backend_url,
+                        code_path=code_path,
+                        packages_path=packages_path,
+                        reuse_archives=args.reuse_archives,
+                    )
+                    deploy_result = await run_phase(
+                        f"PUT /agent (packages {packages_size})",
+                        backend.pid,
+                        stand_in_app,
+                        deploy_agents(session, scenario, agents, args.requests),
+                    )
+                    summary = deploy_result.summary()
+                    summary["accept_latency_ms"] = latency_percentiles(
+                        scenario.accept_latencies
+                    )
+                    summaries.append(summary)
+                    packages_path.unlink()
+    finally:
+        backend.terminate()
+        backend.wait()
+        await stand_in_runner.cleanup()
+    return summaries
+
+
+def print_summaries(summaries: list[dict]) -> None:
+    for summary in summaries:
+        print(f"\n== {summary['phase']} ==")
+        print(
+            f"requests: {summary['requests']}  errors: {summary['errors'] or 0}  throughput: {summary['throughput_rps']} req/s"
+        )
+        print(f"latency (ms): {summary['latency_ms']}")
+        if "accept_latency_ms" in summary:
+            print(f"accept latency (ms): {summary['accept_latency_ms']}")
+        print(f"backend peak RSS: {summary['backend_peak_rss_mb']} MB")
+        print(f"upstream data per request: {summary['upstream_mb_per_request']} MB")
+        print("upstream calls per request:")
+        for call, count in summary["upstream_calls_per_request"].items():
+            print(f"  {call}: {count}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="python -m loadtest", description=__doc__.strip().splitlines()[0]
+    )
+    parser.add_argument(
+        "--requests", type=int, default=20, help="Number of deploys per packages size"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Number of agents created and deployed in parallel",
+    )
+    parser.add_argument("--code-size", default="100KB", help="Size of the code archive")
+    parser.add_argument(
+        "--packages-sizes",
+        default="1MB,10MB,50MB",
+        help="Comma-separated sizes of packages archives",
+    )
+    parser.add_argument(
+        "--reuse-archives",
+        action="store_true",
+        help="Send the same archives on every deploy instead of unique ones",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.02,
+        help="Latency of upstream calls in seconds",
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.01,
+        help="Random latency added to upstream calls in seconds",
+    )
+    parser.add_argument(
+        "--failure-rate",
+        type=float,
+        default=0.0,
+        help="Probability of upstream calls failing",
+    )
+    parser.add_argument(
+        "--upload-bandwidth",
+        default="0",
+        help="Upstream upload bandwidth per second (0 for unlimited)",
+    )
+    parser.add_argument(
+        "--max-concurrent-deploys",
+        type=int,
+        default=4,
+        help="MAX_CONCURRENT_DEPLOYS of the backend",
+    )
+    parser.add_argument(
+        "--max-queued-deploys",
+        type=int,
+        default=16,
+        help="MAX_QUEUED_DEPLOYS of the backend",
+    )
+    parser.add_argument("--backend-port", type=int, default=8100)
+    parser.add_argument("--stand-in-port", type=int, default=8101)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    arguments = parser.parse_args()
+
+    results = asyncio.run(main(arguments))
+    if arguments.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_summaries(results)
@@ -0,0 +1,264 @@
+import asyncio
+import hashlib
+import json
+import random
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any
+
+from aiohttp import BodyPartReader, web
+
+BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+
+def fake_cid(digest: bytes) -> str:
+    """Build a CIDv0 (base58 sha2-256 multihash) from a SHA256 digest"""
+    value = int.from_bytes(b"\x12\x20" + digest, "big")
+    encoded = ""
+    while value > 0:
+        value, remainder = divmod(value, 58)
+        encoded = BASE58_ALPHABET[remainder] + encoded
+    return encoded
+
+
+@dataclass
+class StandInConfig:
+    # Latency added to every upstream call, in seconds
+    latency: float = 0.0
+    # Random latency added on top of the fixed one, in seconds
+    jitter: float = 0.0
+    # Probability of an upstream call failing with a 503
+    failure_rate: float = 0.0
+    # Throughput of the fake IPFS and storage uploads in bytes per second (0 for unlimited)
+    upload_bandwidth: int = 0
+
+
+@dataclass
+class StandInState:
+    messages: dict[str, dict] = field(default_factory=dict)
+    aggregates: dict[str, dict[str, dict]] = field(default_factory=dict)
+    calls: Counter = field(default_factory=Counter)
+    received_bytes: int = 0
+
+    def reset_counters(self) -> None:
+        self.calls = Counter()
+        self.received_bytes = 0
+
+
+def __message_content(message: dict) -> dict:
+    if message.get("content") is None:
+        message["content"] = json.loads(message["item_content"])
+    return message["content"]
+
+
+def __add_message(state: StandInState, message: dict) -> None:
+    content = __message_content(message)
+    state.messages[message["item_hash"]] = message
+    if message["type"] == "AGGREGATE":
+        aggregate = state.aggregates.setdefault(content["address"], {})
+        aggregate.setdefault(content["key"], {}).update(content["content"])
+
+
+async def __read_upload(
+    request: web.Request, config: StandInConfig
+) -> tuple[bytes, int, dict | None]:
+    """Consume a multipart upload, returning the SHA256 and size of the file and the metadata if any"""
+    state: StandInState = request.app["state"]
+    sha256 = hashlib.sha256()
+    size = 0
+    metadata = None
+    reader = await request.multipart()
+    while (part := await reader.next()) is not None:
+        if not isinstance(part, BodyPartReader):
+            # Nested multipart bodies aren't sent by the backend
+            continue
+        if part.name == "metadata":
+            metadata = json.loads(await part.text())
+            continue
+        while chunk := await part.read_chunk():
+            sha256.update(chunk)
+            size += len(chunk)
+            if config.upload_bandwidth > 0:
+                await asyncio.sleep(len(chunk) / config.upload_bandwidth)
+    state.received_bytes += size
+    return sha256.digest(), size, metadata
+
+
+def create_stand_in_app(config: StandInConfig) -> web.Application:
+    """Create an app imitating the parts of the Aleph API and of the IPFS API used by the backend"""
+    state = StandInState()
+
+    @web.middleware
+    async def upstream_conditions(request: web.Request, handler):
+        route = request.match_info.route.resource
+        state.calls[
+            f"{request.method} {route.canonical if route else request.path}"
+        ] += 1
+        delay = config.latency + random.uniform(0, config.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if random.random() < config.failure_rate:
+            return web.json_response({"error": "Injected failure"}, status=503)
+        return await handler(request)
+
+    async def post_message(request: web.Request) -> web.Response:
+        body = await request.json()
+        __add_message(state, body["message"])
+        return web.json_response(
+            {
+                "publication_status": {"status": "success", "failed": []},
+                "message_status": "processed",
+            },
+            status=200,
+        )
+
+    async def get_message(request: web.Request) -> web.Response:
+        item_hash = request.match_info["item_hash"]
+        message = state.messages.get(item_hash)
+        if message is None:
+            return web.json_response({"error": "Message not found"}, status=404)
+        return web.json_response(
+            {"status": "processed", "item_hash": item_hash, "message": message}
+        )
+
+    def __filter(request: web.Request, name: str) -> set[str] | None:
+        value = request.query.get(name)
+        return set(value.split(",")) if value else None
+
+    async def get_messages(request: web.Request) -> web.Response:
+        types = __filter(request, "msgTypes")
+        refs = __filter(request, "refs")
+        addresses = __filter(request, "addresses")
+        channels = __filter(request, "channels")
+        page_size = int(request.query.get("pagination", 200))
+
+        messages = [
+            message
+            for message in state.messages.values()
+            if (types is None or message["type"] in types)
+            and (refs is None or message["content"].get("ref") in refs)
+            and (addresses is None or message["sender"] in addresses)
+            and (channels is None or message["channel"] in channels)
+        ]
+        messages.sort(key=lambda message: message["time"], reverse=True)
+        return web.json_response(
+            {
+                "messages": messages[:page_size],
+                "pagination_page": 1,
+                "pagination_total": len(messages),
+                "pagination_per_page": page_size,
+                "pagination_item": "messages",
+            }
+        )
+
+    async def get_posts(request: web.Request) -> web.Response:
+        types = __filter(request, "types")
+        tags = __filter(request, "tags")
+        addresses = __filter(request, "addresses")
+        page_size = int(request.query.get("pagination", 200))
+
+        posts: list[dict[str, Any]] = []
+        for message in state.messages.values():
+            content = message["content"]
+            if message["type"] != "POST" or content["type"] == "amend":
+                continue
+            if types is not None and content["type"] not in types:
+                continue
+            if addresses is not None and message["sender"] not in addresses:
+                continue
+            if tags is not None and not tags.intersection(
+                content["content"].get("tags", [])
+            ):
+                continue
+            # Applying the latest amend, like the real API
+            amends = [
+                amend
+                for amend in state.messages.values()
+                if amend["type"] == "POST"
+                and amend["content"]["type"] == "amend"
+                and amend["content"].get("ref") == message["item_hash"]
+            ]
+            latest = max(amends, key=lambda amend: amend["time"]) if amends else message
+            posts.append(
+                {
+                    "chain": message["chain"],
+                    "item_hash": message["item_hash"],
+                    "sender": message["sender"],
+                    "type": content["type"],
+                    "channel": message["channel"],
+                    "confirmed": False,
+                    "content": latest["content"]["content"],
+                    "item_content": latest.get("item_content"),
+                    "item_type": latest["item_type"],
+                    "signature": latest.get("signature"),
+                    "size": len(latest.get("item_content") or ""),
+                    "time": latest["time"],
+                    "confirmations": [],
+                    "original_item_hash": message["item_hash"],
+                    "original_signature": message.get("signature"),
+                    "original_type": content["type"],
+                    "hash": latest["item_hash"],
+                    "ref": content.get("ref"),
+                }
+            )
+        return web.json_response(
+            {
+                "posts": posts[:page_size],
+                "pagination_page": 1,
+                "pagination_total": len(posts),
+                "pagination_per_page": page_size,
+                "pagination_item": "posts",
+            }
+        )
+
+    async def get_aggregate(request: web.Request) -> web.Response:
+        address = request.match_info["address"]
+        aggregate = state.aggregates.get(address)
+        if aggregate is None:
+            return web.json_response({"error": "Aggregate not found"}, status=404)
+        keys = __filter(request, "keys")
+        data = {
+            key: value
+            for key, value in aggregate.items()
+            if keys is None or key in keys
+        }
+        return web.json_response({"address": address, "data": data})
+
+    async def storage_add_file(request: web.Request) -> web.Response:
+        digest, _, metadata = await __read_upload(request, config)
+        if metadata is not None:
+            __add_message(state, metadata["message"])
+        return web.json_response({"status": "success", "hash": digest.hex()})
+
+    async def ipfs_add(request: web.Request) -> web.Response:
+        digest, size, _ = await __read_upload(request, config)
+        return web.json_response(
+            {"Name": "file", "Hash": fake_cid(digest), "Size": str(size)}
+        )
+
+    app = web.Application(middlewares=[upstream_conditions], client_max_size=0)
+    app["state"] = state
+    app.router.add_post("/api/v0/messages", post_message)
+    app.router.add_get("/api/v0/messages.json", get_messages)
+    app.router.add_get("/api/v0/messages/{item_hash}", get_message)
+    app.router.add_get("/api/v0/posts.json", get_posts)
+    app.router.add_get("/api/v0/aggregates/{address}.json", get_aggregate)
+    app.router.add_post("/api/v0/storage/add_file", storage_add_file)
+    # IPFS API, served on the same app to keep a single stand-in server
+    app.router.add_post("/api/v0/add", ipfs_add)
+    return app
+
+
+def get_state(app: web.Application) -> StandInState:
+    return app["state"]
+
+
+async def start_stand_in(
+    config: StandInConfig, port: int
+) -> tuple[web.AppRunner, web.Application]:
+    """Serve the stand-in services on localhost"""
+    app = create_stand_in_app(config)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner, app
@@ -11,9 +11,16 @@ class _Config:
     ALEPH_SENDER_PK: bytes
     ALEPH_CHANNEL: str
     ALEPH_AGENT_POST_TYPE: str
+    ALEPH_STORAGE_INDEX_KEY: str
+
+    IPFS_API_URL: str
 
     SUBSCRIPTION_BACKEND_PASSWORD: str
 
+    MAX_CONCURRENT_DEPLOYS: int
+    MAX_QUEUED_DEPLOYS: int
+    DEPLOY_JOB_RETENTION: int
+
     def __init__(self):
         load_dotenv()
 
@@ -25,8 +32,19 @@ class _Config:
         self.ALEPH_AGENT_POST_TYPE = os.getenv(
             "ALEPH_AGENT_POST_TYPE", "libertai-agent"
         )
+        self.ALEPH_STORAGE_INDEX_KEY = os.getenv(
+            "ALEPH_STORAGE_INDEX_KEY", "libertai-agent-storage-index"
+        )
+
+        self.IPFS_API_URL = os.getenv("IPFS_API_URL", "https://ipfs.aleph.cloud")
 
         self.SUBSCRIPTION_BACKEND_PASSWORD = os.getenv("SUBSCRIPTION_BACKEND_PASSWORD")
 
+        self.MAX_CONCURRENT_DEPLOYS = int(os.getenv("MAX_CONCURRENT_DEPLOYS", "4"))
+        # Number of deployments that can wait for a free slot, each one keeps a copy of its archives on disk
+        self.MAX_QUEUED_DEPLOYS = int(os.getenv("MAX_QUEUED_DEPLOYS", "16"))
+        # Number of seconds finished deploy jobs are kept for status queries
+        self.DEPLOY_JOB_RETENTION = int(os.getenv("DEPLOY_JOB_RETENTION", "3600"))
+
 
 config = _Config()
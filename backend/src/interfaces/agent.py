@@ -21,10 +21,6 @@ class SetupAgentBody(DeleteAgentBody):
     account: SubscriptionAccount
 
 
-class UpdateAgentResponse(BaseModel):
-    vm_hash: str
-
-
 class Agent(BaseModel):
     id: str
     subscription_id: str
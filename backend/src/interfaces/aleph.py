@@ -1,3 +1,4 @@
+from aleph.sdk.types import StorageEnum
 from pydantic.main import BaseModel
 
 
@@ -6,3 +7,17 @@ class AlephVolume(BaseModel):
     mount: str
     ref: str
     use_latest: bool
+
+
+class StoredContent(BaseModel):
+    item_type: StorageEnum
+    item_hash: str
+
+
+class UploadedFile(BaseModel):
+    ref: str
+    size: int
+    # Content unchanged from the previous version, no new STORE message
+    skipped: bool = False
+    # Content already stored on Aleph, only a new STORE message was created
+    deduplicated: bool = False
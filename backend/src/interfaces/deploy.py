@@ -0,0 +1,43 @@
+from enum import Enum
+
+from pydantic import BaseModel
+
+
+class DeployJobStatus(str, Enum):
+    queued = "queued"
+    fetching = "fetching"
+    uploading = "uploading"
+    registering = "registering"
+    completed = "completed"
+    failed = "failed"
+
+
+class DeployJobUpload(BaseModel):
+    name: str
+    total_bytes: int
+    uploaded_bytes: int = 0
+    # Content unchanged from the previous version
+    skipped: bool = False
+    # Content already stored on Aleph, reused without being sent again
+    deduplicated: bool = False
+
+
+class DeployJob(BaseModel):
+    id: str
+    agent_id: str
+    status: DeployJobStatus
+    uploads: list[DeployJobUpload]
+    vm_hash: str | None = None
+    # Proportion of the bytes that didn't have to be uploaded, once the uploads are done
+    dedup_ratio: float | None = None
+    error: str | None = None
+    created_at: int
+    updated_at: int
+
+    @property
+    def finished(self) -> bool:
+        return self.status in [DeployJobStatus.completed, DeployJobStatus.failed]
+
+
+class DeployAgentResponse(BaseModel):
+    job_id: str
@@ -1,13 +1,13 @@
 import base64
 import time
+from contextlib import asynccontextmanager
 from http import HTTPStatus
 from uuid import uuid4
 
 from aleph.sdk import AuthenticatedAlephHttpClient
 from aleph.sdk.chains.ethereum import ETHAccount
-from aleph_message.models.execution import Encoding
-from ecies import encrypt, decrypt
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from ecies import encrypt
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
 from starlette.middleware.cors import CORSMiddleware
 
 from src.config import config
@@ -15,13 +15,31 @@ from src.interfaces.agent import (
     Agent,
     SetupAgentBody,
     DeleteAgentBody,
-    UpdateAgentResponse,
 )
-from src.interfaces.aleph import AlephVolume
-from src.utils.agent import fetch_agents, fetch_agent_program_message
-from src.utils.storage import upload_file
+from src.interfaces.deploy import DeployAgentResponse, DeployJob
+from src.utils.agent import (
+    fetch_agents,
+    verify_secret,
+)
+from src.utils.deploy import DeployJobManager
+from src.utils.storage import copy_upload_file
 
-app = FastAPI(title="LibertAI agents")
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    # A single authenticated client (and its connection pool) is shared by all the requests
+    aleph_account = ETHAccount(config.ALEPH_SENDER_SK)
+    async with AuthenticatedAlephHttpClient(
+        account=aleph_account, api_server=config.ALEPH_API_URL
+    ) as aleph_client:
+        deploy_jobs = DeployJobManager(
+            aleph_client, config.MAX_CONCURRENT_DEPLOYS, config.MAX_QUEUED_DEPLOYS
+        )
+        yield {"aleph_client": aleph_client, "deploy_jobs": deploy_jobs}
+        await deploy_jobs.close()
+
+
+app = FastAPI(title="LibertAI agents", lifespan=lifespan)
 
 origins = [
     "https://chat.libertai.io",
@@ -36,8 +54,24 @@ app.add_middleware(
 )
 
 
+def __check_can_deploy(deploy_jobs: DeployJobManager, agent_id: str) -> None:
+    """Raise an HTTP error if a deploy job can't be submitted for this agent right now"""
+    running_job = deploy_jobs.get_running_job(agent_id)
+    if running_job is not None:
+        raise HTTPException(
+            status_code=HTTPStatus.CONFLICT,
+            detail=f"Agent {agent_id} is already being deployed by job {running_job.id}.",
+        )
+    if deploy_jobs.is_queue_full():
+        raise HTTPException(
+            status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+            detail="Too many deployments are waiting to start, please try again later.",
+        )
+
+
 @app.post("/agent", description="Setup a new agent on subscription")
-async def setup(body: SetupAgentBody) -> None:
+async def setup(body: SetupAgentBody, request: Request) -> None:
+    aleph_client: AuthenticatedAlephHttpClient = request.state.aleph_client
     agent_id = str(uuid4())
 
     secret = str(uuid4())
@@ -55,25 +89,26 @@ async def setup(body: SetupAgentBody) -> None:
         tags=[agent_id, body.subscription_id, body.account.address],
     )
 
-    aleph_account = ETHAccount(config.ALEPH_SENDER_SK)
-    async with AuthenticatedAlephHttpClient(
-        account=aleph_account, api_server=config.ALEPH_API_URL
-    ) as client:
-        post_message, _ = await client.create_post(
-            post_content=agent.dict(),
-            post_type=config.ALEPH_AGENT_POST_TYPE,
-            channel=config.ALEPH_CHANNEL,
-        )
+    post_message, _ = await aleph_client.create_post(
+        post_content=agent.dict(),
+        post_type=config.ALEPH_AGENT_POST_TYPE,
+        channel=config.ALEPH_CHANNEL,
+    )
 
 
-@app.put("/agent", description="Deploy an agent or update it")
+@app.put(
+    "/agent",
+    description="Deploy an agent or update it in the background, returning the ID of the deploy job",
+)
 async def update(
+    request: Request,
     agent_id: str = Form(),
     secret: str = Form(),
     code: UploadFile = File(...),
     packages: UploadFile = File(...),
-) -> UpdateAgentResponse:
-    agents = await fetch_agents([agent_id])
+) -> DeployAgentResponse:
+    aleph_client: AuthenticatedAlephHttpClient = request.state.aleph_client
+    agents = await fetch_agents(aleph_client, [agent_id])
 
     if len(agents) != 1:
         raise HTTPException(
@@ -81,71 +116,46 @@ async def update(
             detail=f"Agent with ID {agent_id} not found.",
         )
     agent = agents[0]
-    agent_program = (
-        await fetch_agent_program_message(agent.vm_hash)
-        if agent.vm_hash is not None
-        else None
-    )
 
-    # Decode the base64 secret
-    encrypted_secret = base64.b64decode(agent.encrypted_secret)
-
-    decrypted_secret = decrypt(config.ALEPH_SENDER_SK, encrypted_secret).decode()
-    if secret != decrypted_secret:
+    if not verify_secret(agent, secret):
         raise HTTPException(
             status_code=HTTPStatus.UNAUTHORIZED,
             detail="The secret provided doesn't match the one of this agent.",
         )
 
-    previous_code_ref = (
-        agent_program.content.code.ref if agent_program is not None else None
-    )
-    # TODO: additional checks on the type of volume, find the right one based on mount etc
-    previous_packages_ref = (
-        agent_program.content.volumes[0].ref if agent_program is not None else None  # type: ignore
-    )
+    # Rejecting the request before copying the archives if it can't be deployed
+    deploy_jobs: DeployJobManager = request.state.deploy_jobs
+    __check_can_deploy(deploy_jobs, agent.id)
 
-    code_ref = await upload_file(code, previous_code_ref)
-    packages_ref = await upload_file(packages, previous_packages_ref)
+    # The received files are closed at the end of the request, copying them for the background job
+    code_copy = await copy_upload_file(code)
+    packages_copy = await copy_upload_file(packages)
 
-    if agent_program is not None:
-        # Program is already deployed and we updated the volumes, exiting here
-        return UpdateAgentResponse(vm_hash=agent_program.item_hash)
+    # Checked again after the copies as another request may have submitted a job in the meantime
+    try:
+        __check_can_deploy(deploy_jobs, agent.id)
+    except HTTPException:
+        await code_copy.close()
+        await packages_copy.close()
+        raise
+
+    job = deploy_jobs.submit(agent, code_copy, packages_copy)
+    return DeployAgentResponse(job_id=job.id)
 
-    # Register the program
-    aleph_account = ETHAccount(config.ALEPH_SENDER_SK)
-    async with AuthenticatedAlephHttpClient(
-        account=aleph_account, api_server=config.ALEPH_API_URL
-    ) as client:
-        message, _ = await client.create_program(
-            program_ref=code_ref,
-            entrypoint="run",
-            runtime="63f07193e6ee9d207b7d1fcf8286f9aee34e6f12f101d2ec77c1229f92964696",
-            channel=config.ALEPH_CHANNEL,
-            encoding=Encoding.squashfs,
-            persistent=False,
-            volumes=[
-                AlephVolume(
-                    comment="Python packages",
-                    mount="/opt/packages",
-                    ref=packages_ref,
-                    use_latest=True,
-                ).dict()
-            ],
-        )
 
-        # Updating the related POST message
-        await client.create_post(
-            post_content=Agent(
-                **agent.dict(exclude={"vm_hash", "last_update"}),
-                vm_hash=message.item_hash,
-                last_update=int(time.time()),
-            ),
-            post_type="amend",
-            ref=agent.post_hash,
-            channel=config.ALEPH_CHANNEL,
+@app.get(
+    "/agent/deploy/{job_id}", description="Get the progress of an agent deployment"
+)
+async def get_deploy_job(job_id: str, request: Request) -> DeployJob:
+    deploy_jobs: DeployJobManager = request.state.deploy_jobs
+    job = deploy_jobs.get_job(job_id)
+
+    if job is None:
+        raise HTTPException(
+            status_code=HTTPStatus.NOT_FOUND,
+            detail=f"Deploy job with ID {job_id} not found.",
         )
-    return UpdateAgentResponse(vm_hash=message.item_hash)
+    return job
 
 
 @app.delete("/agent", description="Remove an agent on subscription end")
@@ -1,27 +1,51 @@
+import base64
+import hashlib
+import hmac
+from functools import lru_cache
+
 from aleph.sdk import AlephHttpClient
 from aleph.sdk.query.filters import PostFilter
 from aleph_message.models import ProgramMessage
+from ecies import decrypt
 
 from src.config import config
-from src.interfaces.agent import FetchedAgent
-
-
-async def fetch_agents(ids: list[str] | None = None) -> list[FetchedAgent]:
-    async with AlephHttpClient(api_server=config.ALEPH_API_URL) as client:
-        result = await client.get_posts(
-            post_filter=PostFilter(
-                types=[config.ALEPH_AGENT_POST_TYPE],
-                addresses=[config.ALEPH_SENDER],
-                tags=ids,
-                channels=[config.ALEPH_CHANNEL],
-            )
+from src.interfaces.agent import Agent, FetchedAgent
+
+
+async def fetch_agents(
+    client: AlephHttpClient, ids: list[str] | None = None
+) -> list[FetchedAgent]:
+    result = await client.get_posts(
+        post_filter=PostFilter(
+            types=[config.ALEPH_AGENT_POST_TYPE],
+            addresses=[config.ALEPH_SENDER],
+            tags=ids,
+            channels=[config.ALEPH_CHANNEL],
         )
+    )
     return [
         FetchedAgent(**post.content, post_hash=post.item_hash) for post in result.posts
     ]
 
 
-async def fetch_agent_program_message(item_hash: str) -> ProgramMessage:
-    async with AlephHttpClient(api_server=config.ALEPH_API_URL) as client:
-        result = await client.get_message(item_hash, ProgramMessage)
-        return result
+async def fetch_agent_program_message(
+    client: AlephHttpClient, item_hash: str
+) -> ProgramMessage:
+    result = await client.get_message(item_hash, ProgramMessage)
+    return result
+
+
+@lru_cache(maxsize=1024)
+def get_secret_digest(encrypted_secret: str) -> bytes:
+    """Get the SHA256 of the base64 encoded secret of an agent.
+    Cached as ECIES decryption is costly, only the digest is kept to avoid having plaintext secrets in memory"""
+    secret = decrypt(config.ALEPH_SENDER_SK, base64.b64decode(encrypted_secret))
+    return hashlib.sha256(secret).digest()
+
+
+def verify_secret(agent: Agent, secret: str) -> bool:
+    """Check in constant time if a secret is the one of an agent"""
+    return hmac.compare_digest(
+        get_secret_digest(agent.encrypted_secret),
+        hashlib.sha256(secret.encode()).digest(),
+    )
@@ -0,0 +1,232 @@
+import asyncio
+import time
+from uuid import uuid4
+
+from aleph.sdk import AuthenticatedAlephHttpClient
+from aleph_message.models import ItemHash, ProgramMessage
+from aleph_message.models.execution import Encoding
+from starlette.datastructures import UploadFile
+
+from src.config import config
+from src.interfaces.agent import Agent, FetchedAgent
+from src.interfaces.aleph import AlephVolume, StoredContent
+from src.interfaces.deploy import DeployJob, DeployJobStatus, DeployJobUpload
+from src.utils.agent import fetch_agent_program_message
+from src.utils.storage import fetch_storage_index, upload_file
+
+
+class DeployJobManager:
+    """Run agent deployments in the background, with a bounded concurrency and queue, and at most one job per agent"""
+
+    client: AuthenticatedAlephHttpClient
+    jobs: dict[str, DeployJob]
+    max_queued_deploys: int
+
+    def __init__(
+        self,
+        client: AuthenticatedAlephHttpClient,
+        max_concurrent_deploys: int,
+        max_queued_deploys: int,
+    ):
+        self.client = client
+        self.jobs = {}
+        self.max_queued_deploys = max_queued_deploys
+        self.__semaphore = asyncio.Semaphore(max_concurrent_deploys)
+        self.__tasks: set[asyncio.Task] = set()
+
+    def get_job(self, job_id: str) -> DeployJob | None:
+        return self.jobs.get(job_id)
+
+    def get_running_job(self, agent_id: str) -> DeployJob | None:
+        """Get the unfinished deploy job of an agent, if any"""
+        for job in self.jobs.values():
+            if job.agent_id == agent_id and not job.finished:
+                return job
+        return None
+
+    def is_queue_full(self) -> bool:
+        """Check if the number of jobs waiting for a deployment slot reached the limit"""
+        queued_jobs = sum(
+            1 for job in self.jobs.values() if job.status == DeployJobStatus.queued
+        )
+        return queued_jobs >= self.max_queued_deploys
+
+    def submit(
+        self, agent: FetchedAgent, code: UploadFile, packages: UploadFile
+    ) -> DeployJob:
+        """
+        Queue the deployment of an agent
+
+        :param agent: Agent to deploy
+        :param code: Code archive, must stay open until the job is done (it's closed by the job)
+        :param packages: Packages archive, must stay open until the job is done (it's closed by the job)
+        :return: The created job
+        """
+        self.__prune_jobs()
+
+        now = int(time.time())
+        job = DeployJob(
+            id=str(uuid4()),
+            agent_id=agent.id,
+            status=DeployJobStatus.queued,
+            uploads=[
+                DeployJobUpload(name="code", total_bytes=code.size or 0),
+                DeployJobUpload(name="packages", total_bytes=packages.size or 0),
+            ],
+            created_at=now,
+            updated_at=now,
+        )
+        self.jobs[job.id] = job
+
+        task = asyncio.create_task(self.__run(job, agent, code, packages))
+        # Keeping a reference to avoid the task being garbage collected
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+        return job
+
+    async def close(self) -> None:
+        """Cancel the jobs still running"""
+        for task in self.__tasks:
+            task.cancel()
+        await asyncio.gather(*self.__tasks, return_exceptions=True)
+
+    def __prune_jobs(self) -> None:
+        """Forget finished jobs older than the retention period"""
+        limit = int(time.time()) - config.DEPLOY_JOB_RETENTION
+        self.jobs = {
+            job_id: job
+            for job_id, job in self.jobs.items()
+            if not job.finished or job.updated_at > limit
+        }
+
+    @staticmethod
+    def __set_status(job: DeployJob, status: DeployJobStatus) -> None:
+        job.status = status
+        job.updated_at = int(time.time())
+
+    @staticmethod
+    def __compute_dedup_ratio(uploads: list[DeployJobUpload]) -> float:
+        """Proportion of the bytes of a deployment that didn't have to be sent to Aleph"""
+        total_bytes = sum(upload.total_bytes for upload in uploads)
+        if total_bytes == 0:
+            return 0.0
+        reused_bytes = sum(
+            upload.total_bytes
+            for upload in uploads
+            if upload.skipped or upload.deduplicated
+        )
+        return reused_bytes / total_bytes
+
+    async def __run(
+        self,
+        job: DeployJob,
+        agent: FetchedAgent,
+        code: UploadFile,
+        packages: UploadFile,
+    ) -> None:
+        try:
+            async with self.__semaphore:
+                job.vm_hash = await self.__deploy(job, agent, code, packages)
+            self.__set_status(job, DeployJobStatus.completed)
+        except asyncio.CancelledError:
+            job.error = "Deployment cancelled"
+            self.__set_status(job, DeployJobStatus.failed)
+            raise
+        except Exception as error:
+            job.error = str(error)
+            self.__set_status(job, DeployJobStatus.failed)
+        finally:
+            await code.close()
+            await packages.close()
+
+    async def __upload(
+        self,
+        upload: DeployJobUpload,
+        file: UploadFile,
+        previous_ref: ItemHash | None,
+        storage_index: dict[str, StoredContent] | None = None,
+    ) -> str:
+        def on_progress(sent_bytes: int) -> None:
+            upload.uploaded_bytes += sent_bytes
+
+        uploaded_file = await upload_file(
+            self.client, file, previous_ref, on_progress, storage_index
+        )
+        upload.skipped = uploaded_file.skipped
+        upload.deduplicated = uploaded_file.deduplicated
+        return uploaded_file.ref
+
+    async def __fetch_agent_program(self, agent: FetchedAgent) -> ProgramMessage | None:
+        if agent.vm_hash is None:
+            return None
+        return await fetch_agent_program_message(self.client, agent.vm_hash)
+
+    async def __deploy(
+        self,
+        job: DeployJob,
+        agent: FetchedAgent,
+        code: UploadFile,
+        packages: UploadFile,
+    ) -> str:
+        """Upload the agent volumes and register its program if needed, returning the program hash"""
+        self.__set_status(job, DeployJobStatus.fetching)
+        agent_program, storage_index = await asyncio.gather(
+            self.__fetch_agent_program(agent),
+            # Fetched once for the deployment, only the packages are indexed as the code changes on every deploy
+            fetch_storage_index(self.client),
+        )
+
+        previous_code_ref = (
+            agent_program.content.code.ref if agent_program is not None else None
+        )
+        # TODO: additional checks on the type of volume, find the right one based on mount etc
+        previous_packages_ref = (
+            agent_program.content.volumes[0].ref if agent_program is not None else None  # type: ignore
+        )
+
+        self.__set_status(job, DeployJobStatus.uploading)
+        code_upload, packages_upload = job.uploads
+        # Both volumes are independent, uploading them at the same time
+        code_ref, packages_ref = await asyncio.gather(
+            self.__upload(code_upload, code, previous_code_ref),
+            self.__upload(
+                packages_upload, packages, previous_packages_ref, storage_index
+            ),
+        )
+        job.dedup_ratio = self.__compute_dedup_ratio(job.uploads)
+
+        if agent_program is not None:
+            # Program is already deployed and we updated the volumes, exiting here
+            return agent_program.item_hash
+
+        # Register the program
+        self.__set_status(job, DeployJobStatus.registering)
+        message, _ = await self.client.create_program(
+            program_ref=code_ref,
+            entrypoint="run",
+            runtime="63f07193e6ee9d207b7d1fcf8286f9aee34e6f12f101d2ec77c1229f92964696",
+            channel=config.ALEPH_CHANNEL,
+            encoding=Encoding.squashfs,
+            persistent=False,
+            volumes=[
+                AlephVolume(
+                    comment="Python packages",
+                    mount="/opt/packages",
+                    ref=packages_ref,
+                    use_latest=True,
+                ).dict()
+            ],
+        )
+
+        # Updating the related POST message
+        await self.client.create_post(
+            post_content=Agent(
+                **agent.dict(exclude={"vm_hash", "last_update"}),
+                vm_hash=message.item_hash,
+                last_update=int(time.time()),
+            ),
+            post_type="amend",
+            ref=agent.post_hash,
+            channel=config.ALEPH_CHANNEL,
+        )
+        return message.item_hash
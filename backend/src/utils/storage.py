@@ -1,57 +1,196 @@
-from typing import Any
+import hashlib
+from http import HTTPStatus
+from tempfile import SpooledTemporaryFile
+from typing import AsyncIterator, BinaryIO, Callable, cast
 
 import aiohttp
 from aleph.sdk import AuthenticatedAlephHttpClient
-from aleph.sdk.chains.ethereum import ETHAccount
+from aleph.sdk.query.filters import MessageFilter
 from aleph.sdk.types import StorageEnum
-from aleph_message.models import ItemHash
+from aleph_message.models import ItemHash, MessageType, StoreMessage
 from starlette.datastructures import UploadFile
 
 from src.config import config
+from src.interfaces.aleph import StoredContent, UploadedFile
 
-MAX_DIRECT_STORE_SIZE = 50 * 1024 * 1024  # 50MB
+# Files bigger than this are streamed to the IPFS gateway instead of being sent to Aleph in a single buffer
+MAX_DIRECT_STORE_SIZE = 4 * 1024 * 1024  # 4MB
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
 
 
-async def __upload_on_ipfs(file_content: Any, filename: str | None = None) -> str:
-    """Upload a file on the IPFS gateway of Aleph and return the CID"""
+async def __hash_file(file: UploadFile) -> tuple[str, int]:
+    """Compute the SHA256 and size of an uploaded file chunk by chunk, and rewind it"""
+    sha256 = hashlib.sha256()
+    file_size = 0
+    await file.seek(0)
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        sha256.update(chunk)
+        file_size += len(chunk)
+    await file.seek(0)
+    return sha256.hexdigest(), file_size
+
+
+def __store_message_sha256(message: StoreMessage) -> str | None:
+    """Get the SHA256 of the content of a STORE message, if known"""
+    if message.content.item_type == StorageEnum.storage:
+        # Aleph native storage uses the SHA256 of the content as its hash
+        return message.content.item_hash
+    metadata = message.content.metadata or {}
+    return metadata.get("sha256")
+
+
+async def __fetch_latest_store_message(
+    client: AuthenticatedAlephHttpClient, ref: ItemHash
+) -> StoreMessage:
+    """Get the latest version of a STORE message, following its amends"""
+    result = await client.get_messages(
+        page_size=1,
+        message_filter=MessageFilter(
+            message_types=[MessageType.store],
+            addresses=[config.ALEPH_SENDER],
+            refs=[ref],
+            channels=[config.ALEPH_CHANNEL],
+        ),
+    )
+    if len(result.messages) > 0:
+        return result.messages[0]  # type: ignore
+    return await client.get_message(ref, StoreMessage)
+
+
+async def __read_chunks(
+    file: UploadFile, on_progress: Callable[[int], None] | None = None
+) -> AsyncIterator[bytes]:
+    """Read a file chunk by chunk from the beginning, reporting the number of bytes read"""
+    await file.seek(0)
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        yield chunk
+        # The chunk has been consumed (sent) once the iteration resumes
+        if on_progress is not None:
+            on_progress(len(chunk))
+
+
+async def __upload_on_ipfs(
+    file: UploadFile, on_progress: Callable[[int], None] | None = None
+) -> str:
+    """Stream a file to the IPFS gateway of Aleph and return the CID"""
     async with aiohttp.ClientSession() as session:
         form_data = aiohttp.FormData()
-        form_data.add_field("file", file_content, filename=filename)
+        # Passing an async iterator lets aiohttp send the file chunk by chunk
+        form_data.add_field(
+            "file", __read_chunks(file, on_progress), filename=file.filename
+        )
         response = await session.post(
-            url="https://ipfs.aleph.cloud/api/v0/add", data=form_data
+            url=f"{config.IPFS_API_URL}/api/v0/add", data=form_data
         )
         ipfs_data = await response.json()
         return ipfs_data["Hash"]
 
 
-async def upload_file(file: UploadFile, previous_ref: ItemHash | None = None) -> str:
-    """Upload a file on Aleph, using an IPFS gateway if needed, and returns the STORE message ref"""
+async def fetch_storage_index(
+    client: AuthenticatedAlephHttpClient,
+) -> dict[str, StoredContent]:
+    """Get the storage index aggregate, mapping the SHA256 of contents already stored on Aleph to their storage"""
+    try:
+        index = await client.fetch_aggregate(
+            config.ALEPH_SENDER, config.ALEPH_STORAGE_INDEX_KEY
+        )
+    except aiohttp.ClientResponseError as error:
+        if error.status == HTTPStatus.NOT_FOUND:
+            # Nothing has been indexed yet
+            return {}
+        raise error
+    return {
+        file_hash: StoredContent(**stored_content)
+        for file_hash, stored_content in (index or {}).items()
+    }
 
-    file_content = await file.read()
-    file_size = len(file_content)
-    storage_engine = (
-        StorageEnum.ipfs if file_size > 4 * 1024 * 1024 else StorageEnum.storage
-    )
 
-    aleph_account = ETHAccount(config.ALEPH_SENDER_SK)
-    async with AuthenticatedAlephHttpClient(
-        account=aleph_account, api_server=config.ALEPH_API_URL
-    ) as client:
-        if file_size > MAX_DIRECT_STORE_SIZE:
-            ipfs_hash = await __upload_on_ipfs(file_content, file.filename)
-            store_message, _ = await client.create_store(
-                ref=previous_ref,
-                file_hash=ipfs_hash,
-                storage_engine=storage_engine,
-                channel=config.ALEPH_CHANNEL,
-                guess_mime_type=True,
-            )
-        else:
-            store_message, _ = await client.create_store(
-                ref=previous_ref,
-                file_content=file_content,
-                storage_engine=storage_engine,
-                channel=config.ALEPH_CHANNEL,
-                guess_mime_type=True,
-            )
-        return store_message.item_hash
+async def upload_file(
+    client: AuthenticatedAlephHttpClient,
+    file: UploadFile,
+    previous_ref: ItemHash | None = None,
+    on_progress: Callable[[int], None] | None = None,
+    storage_index: dict[str, StoredContent] | None = None,
+) -> UploadedFile:
+    """Upload a file on Aleph, using an IPFS gateway if needed, and returns the STORE message ref.
+    If the content is the same as the one of previous_ref, nothing is uploaded and previous_ref is returned.
+    on_progress is called with the number of bytes sent each time a part of the file is uploaded.
+    With a storage_index (from fetch_storage_index), content already stored on Aleph is reused without sending it again,
+    and new content is added to the index"""
+
+    file_hash, file_size = await __hash_file(file)
+
+    if previous_ref is not None:
+        previous_message = await __fetch_latest_store_message(client, previous_ref)
+        if __store_message_sha256(previous_message) == file_hash:
+            return UploadedFile(ref=previous_ref, size=file_size, skipped=True)
+
+    # Stored with the message so that IPFS uploads can be compared with future ones
+    extra_fields = {"metadata": {"sha256": file_hash}}
+
+    stored_content = storage_index.get(file_hash) if storage_index is not None else None
+    if stored_content is not None:
+        store_message, _ = await client.create_store(
+            ref=previous_ref,
+            file_hash=stored_content.item_hash,
+            storage_engine=stored_content.item_type,
+            channel=config.ALEPH_CHANNEL,
+            guess_mime_type=True,
+            extra_fields=extra_fields,
+        )
+        return UploadedFile(
+            ref=store_message.item_hash, size=file_size, deduplicated=True
+        )
+
+    if file_size > MAX_DIRECT_STORE_SIZE:
+        ipfs_hash = await __upload_on_ipfs(file, on_progress)
+        store_message, _ = await client.create_store(
+            ref=previous_ref,
+            file_hash=ipfs_hash,
+            storage_engine=StorageEnum.ipfs,
+            channel=config.ALEPH_CHANNEL,
+            guess_mime_type=True,
+            extra_fields=extra_fields,
+        )
+    else:
+        # Small enough to be kept in memory
+        file_content = await file.read()
+        store_message, _ = await client.create_store(
+            ref=previous_ref,
+            file_content=file_content,
+            storage_engine=StorageEnum.storage,
+            channel=config.ALEPH_CHANNEL,
+            guess_mime_type=True,
+            extra_fields=extra_fields,
+        )
+        if on_progress is not None:
+            on_progress(file_size)
+
+    if storage_index is not None:
+        # Indexing the content so that the next uploads of the same file can reuse it
+        stored_content = StoredContent(
+            item_type=StorageEnum(store_message.content.item_type.value),
+            item_hash=store_message.content.item_hash,
+        )
+        storage_index[file_hash] = stored_content
+        await client.create_aggregate(
+            key=config.ALEPH_STORAGE_INDEX_KEY,
+            content={file_hash: stored_content.dict()},
+            channel=config.ALEPH_CHANNEL,
+        )
+    return UploadedFile(ref=store_message.item_hash, size=file_size)
+
+
+async def copy_upload_file(file: UploadFile) -> UploadFile:
+    """Copy an uploaded file chunk by chunk so that it can outlive the request that received it"""
+    file_copy = UploadFile(
+        file=cast(BinaryIO, SpooledTemporaryFile(max_size=UPLOAD_CHUNK_SIZE)),
+        size=0,
+        filename=file.filename,
+        headers=file.headers,
+    )
+    await file.seek(0)
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        await file_copy.write(chunk)
+    await file_copy.seek(0)
+    return file_copy
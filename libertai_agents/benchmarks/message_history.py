@@ -0,0 +1,155 @@
+"""
+Compare the time and memory used to prepare prompts from a long conversation, between pydantic messages
+converted on every call (previous implementation) and MessageHistory.
+
+The tokenizer is replaced by a stub to only measure the handling of messages, 10k messages take a few minutes as the
+previous implementation renders a prompt for each message that doesn't fit in the context:
+poetry run python benchmarks/message_history.py
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from typing import Callable
+
+from libertai_agents.history import MessageHistory, MessageRecord
+from libertai_agents.interfaces.messages import Message, MessageRoleEnum, MessageToolCall, ToolCallFunction, \
+    ToolCallMessage, ToolResponseMessage
+from libertai_agents.models.hermes import HermesModel
+
+TOOL_ROUNDS = 3
+# Average number of characters per token of the stub tokenizer
+CHARACTERS_PER_TOKEN = 4
+
+
+class StubTokenizer:
+    @staticmethod
+    def apply_chat_template(conversation: list, **_kwargs) -> str:
+        # Rendering every message like a ChatML template, jinja accepts both dicts and objects
+        messages = [(message["role"], message["content"]) if isinstance(message, dict) else
+                    (message.role, message.content) for message in conversation]
+        return "".join(f"<|im_start|>{role.value}\n{content or ''}<|im_end|>\n" for role, content in messages) + \
+            "<|im_start|>assistant\n"
+
+    @staticmethod
+    def tokenize(content: str) -> list[str]:
+        # Proportional to the length of the text so that long conversations overflow the context
+        return [""] * -(-len(content) // CHARACTERS_PER_TOKEN)
+
+
+def create_model() -> HermesModel:
+    model = HermesModel.__new__(HermesModel)
+    model.tokenizer = StubTokenizer()  # type: ignore
+    model.model_id = "NousResearch/Hermes-2-Pro-Llama-3-8B"
+    model.vm_url = "http://localhost:8080/completion"
+    model.context_length = 8192
+    model.include_system_message = True
+    return model
+
+
+def create_conversation(length: int) -> list[Message]:
+    roles = [MessageRoleEnum.user, MessageRoleEnum.assistant]
+    return [Message(role=roles[i % 2], content=f"Message number {i} of the conversation") for i in range(length)]
+
+
+def create_tool_messages(round_index: int) -> tuple[ToolCallMessage, list[Message]]:
+    call = MessageToolCall(type="function", id=f"call{round_index}",
+                           function=ToolCallFunction(name="get_temperature", arguments={"location": "Paris"}))
+    return (ToolCallMessage(role=MessageRoleEnum.assistant, tool_calls=[call]),
+            [ToolResponseMessage(role=MessageRoleEnum.tool, name="get_temperature", tool_call_id=call.id,
+                                 content="22")])
+
+
+def previous_generate_prompt(model: HermesModel, messages: list[Message], system_prompt: str) -> str:
+    """generate_prompt as it was before MessageHistory"""
+    system_messages = [Message(role=MessageRoleEnum.system, content=system_prompt)]
+    raw_messages = list(map(lambda x: x.dict(), messages))
+
+    for i in range(len(raw_messages)):
+        included_messages: list = system_messages + raw_messages[i:]
+        prompt = model.tokenizer.apply_chat_template(conversation=included_messages, tools=[], tokenize=False,
+                                                     add_generation_prompt=True)
+        if len(model.tokenizer.tokenize(prompt)) <= model.context_length:
+            return prompt
+    raise ValueError("Can't fit messages into the available context length")
+
+
+def previous_implementation(model: HermesModel, messages: list[Message]) -> None:
+    """Tool rounds of generate_answer as they were done before MessageHistory"""
+    for round_index in range(TOOL_ROUNDS):
+        previous_generate_prompt(model, messages, system_prompt="You are a helpful assistant")
+        tool_calls_message, tool_results_messages = create_tool_messages(round_index)
+        messages.append(tool_calls_message)
+        messages = messages + tool_results_messages
+
+
+def message_history(model: HermesModel, history: MessageHistory) -> None:
+    """Tool rounds of generate_answer with MessageHistory"""
+    for round_index in range(TOOL_ROUNDS):
+        model.generate_prompt(history, [], system_prompt="You are a helpful assistant")
+        tool_calls_message, tool_results_messages = create_tool_messages(round_index)
+        history = history.append(MessageRecord.from_message(tool_calls_message))
+        history = history.extend(MessageRecord.from_message(message) for message in tool_results_messages)
+
+
+def measure(run: Callable[[], None], repeat: int) -> tuple[float, float]:
+    """
+    Measure a function
+
+    :return: Average duration in milliseconds and peak memory allocated in MB
+    """
+    gc.collect()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        run()
+    duration = (time.perf_counter() - start) / repeat * 1000
+
+    gc.collect()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duration, peak / 1024 ** 2
+
+
+def retained_memory(create: Callable[[], object]) -> float:
+    """Memory in MB kept by the object returned by create"""
+    gc.collect()
+    tracemalloc.start()
+    kept = create()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return current / 1024 ** 2
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=10_000, help="Length of the conversation")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of runs to average the duration")
+    args = parser.parse_args()
+
+    benchmark_model = create_model()
+    conversation = create_conversation(args.messages)
+    kept_history = MessageHistory.from_messages(conversation)
+    # Same prompt with both implementations, even when the conversation doesn't fit in the context
+    if (previous_generate_prompt(benchmark_model, conversation, "You are a helpful assistant") !=
+            benchmark_model.generate_prompt(kept_history, [], "You are a helpful assistant")):
+        raise AssertionError("Prompts generated by both implementations are different")
+
+    print(f"{args.messages} messages, {TOOL_ROUNDS} tool rounds per answer, "
+          f"context of {benchmark_model.context_length} tokens")
+    print(f"{'':<36}{'time (ms)':>12}{'peak alloc (MB)':>18}")
+    for name, benchmark in [
+        ("pydantic messages (previous)", lambda: previous_implementation(benchmark_model, list(conversation))),
+        ("MessageHistory from messages",
+         lambda: message_history(benchmark_model, MessageHistory.from_messages(conversation))),
+        ("MessageHistory kept between answers", lambda: message_history(benchmark_model, kept_history)),
+    ]:
+        average_duration, peak_memory = measure(benchmark, args.repeat)
+        print(f"{name:<36}{average_duration:>12.1f}{peak_memory:>18.2f}")
+
+    print(f"\n{'retained memory of the history':<36}{'MB':>12}")
+    print(f"{'list of pydantic messages':<36}{retained_memory(lambda: create_conversation(args.messages)):>12.2f}")
+    print(f"{'MessageHistory':<36}"
+          f"{retained_memory(lambda: MessageHistory.from_messages(create_conversation(args.messages))):>12.2f}")
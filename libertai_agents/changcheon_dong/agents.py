@@ -1,5 +1,6 @@
 import asyncio
 import json
+import os
 from http import HTTPStatus
 from typing import Callable, Awaitable, Any, AsyncIterable
 
@@ -8,11 +9,13 @@ from aiohttp import ClientSession
 from fastapi import APIRouter, FastAPI
 from starlette.responses import StreamingResponse
 
+from libertai_agents.history import MessageHistory, MessageRecord
 from libertai_agents.interfaces.llamacpp import CustomizableLlamaCppParams, LlamaCppParams
 from libertai_agents.interfaces.messages import Message, MessageRoleEnum, MessageToolCall, ToolCallFunction, \
-    ToolCallMessage, ToolResponseMessage
+    ToolCallMessage
 from libertai_agents.interfaces.models import ModelInformation
 from libertai_agents.models import Model
+from libertai_agents.serving import serve_app
 from libertai_agents.utils import find
 
 MAX_TOOL_CALLS_DEPTH = 3
@@ -47,6 +50,7 @@ class ChatAgent:
         self.system_prompt = system_prompt
         self.tools = tools
         self.llamacpp_params = llamacpp_params
+        self.app = None
 
         if expose_api:
             # Define API routes
@@ -58,17 +62,41 @@ class ChatAgent:
             self.app = FastAPI(title="LibertAI ChatAgent")
             self.app.include_router(router)
 
+    def serve(self, host: str = "0.0.0.0", port: int = 8000, workers: int | None = None,
+              graceful_timeout: float = 30, memory_report_interval: float | None = None,
+              log_level: str = "info") -> None:
+        """
+        Serve the API of the agent on several worker processes.
+        The workers are forked from the current process, so the model tokenizer already loaded is shared between them
+        instead of being loaded again by each one.
+
+        :param host: Address to bind
+        :param port: Port to bind
+        :param workers: Number of worker processes, defaults to the number of CPUs
+        :param graceful_timeout: Seconds given to the workers to finish their requests when stopping
+        :param memory_report_interval: Seconds between memory usage reports of the workers (reports can also be requested by sending SIGUSR1)
+        :param log_level: Log level of the workers
+        """
+        if self.app is None:
+            raise ValueError("The API of this agent isn't exposed, set expose_api to True to serve it")
+        if workers is None:
+            workers = os.cpu_count() or 1
+        serve_app(self.app, host=host, port=port, workers=workers,
+                  graceful_timeout=graceful_timeout, memory_report_interval=memory_report_interval,
+                  log_level=log_level)
+
     def get_model_information(self) -> ModelInformation:
         """
         Get information about the model powering this agent
         """
         return ModelInformation(id=self.model.model_id, context_length=self.model.context_length)
 
-    async def generate_answer(self, messages: list[Message], only_final_answer: bool = True) -> AsyncIterable[Message]:
+    async def generate_answer(self, messages: list[Message] | MessageHistory,
+                              only_final_answer: bool = True) -> AsyncIterable[Message]:
         """
         Generate an answer based on a conversation
 
-        :param messages: List of messages previously sent in this conversation
+        :param messages: List of messages previously sent in this conversation (it isn't modified)
         :param only_final_answer: Only yields the final answer without include the thought process (tool calls and their response)
         :return: The string response of the agent
         """
@@ -77,8 +105,11 @@ class ChatAgent:
         if messages[-1].role not in [MessageRoleEnum.user, MessageRoleEnum.tool]:
             raise ValueError("Last message is not from the user or a tool response")
 
+        # Pydantic messages are only used in the public interface, the history avoids converting and copying them
+        history = messages if isinstance(messages, MessageHistory) else MessageHistory.from_messages(messages)
+
         for _ in range(MAX_TOOL_CALLS_DEPTH):
-            prompt = self.model.generate_prompt(messages, self.tools, system_prompt=self.system_prompt)
+            prompt = self.model.generate_prompt(history, self.tools, system_prompt=self.system_prompt)
             async with aiohttp.ClientSession() as session:
                 response = await self.__call_model(session, prompt)
 
@@ -93,21 +124,20 @@ class ChatAgent:
 
                 # Executing the detected tool calls
                 tool_calls_message = self.__create_tool_calls_message(tool_calls)
-                messages.append(tool_calls_message)
+                history = history.append(MessageRecord.from_message(tool_calls_message))
                 if not only_final_answer:
                     yield tool_calls_message
 
                 executed_calls = self.__execute_tool_calls(tool_calls_message.tool_calls)
                 results = await asyncio.gather(*executed_calls)
-                tool_results_messages: list[Message] = [
-                    ToolResponseMessage(role=MessageRoleEnum.tool, name=call.function.name, tool_call_id=call.id,
-                                        content=str(results[i])) for i, call in
-                    enumerate(tool_calls_message.tool_calls)]
+                tool_results_records = [
+                    MessageRecord({"role": MessageRoleEnum.tool, "content": str(results[i]), "name": call.function.name,
+                                   "tool_call_id": call.id}) for i, call in enumerate(tool_calls_message.tool_calls)]
                 if not only_final_answer:
-                    for tool_result_message in tool_results_messages:
-                        yield tool_result_message
+                    for tool_result_record in tool_results_records:
+                        yield tool_result_record.to_message()
                 # Doing the next iteration of the loop with the results to make other tool calls or to answer
-                messages = messages + tool_results_messages
+                history = history.extend(tool_results_records)
 
     async def __api_generate_answer(self, messages: list[Message], stream: bool = False,
                                     only_final_answer: bool = True):
@@ -0,0 +1,151 @@
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator, Sequence, overload
+
+from libertai_agents.interfaces.messages import Message, MessageRoleEnum, ToolCallMessage, ToolResponseMessage
+
+
+class MessageRecord:
+    """
+    Immutable and lightweight version of a message, used internally instead of the pydantic models.
+    The serialized dict given to chat templates is computed once and kept.
+    """
+    __slots__ = ("role", "content", "data", "_token_count")
+
+    role: MessageRoleEnum
+    content: str | None
+    # Serialized message, must not be modified
+    data: dict[str, Any]
+    # ID of the model and number of tokens of the content with its tokenizer, computed when first needed
+    _token_count: tuple[str, int] | None
+
+    def __init__(self, data: dict[str, Any]):
+        object.__setattr__(self, "role", data["role"])
+        object.__setattr__(self, "content", data.get("content"))
+        object.__setattr__(self, "data", data)
+        object.__setattr__(self, "_token_count", None)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("MessageRecord is immutable")
+
+    def __repr__(self) -> str:
+        return f"MessageRecord({self.data!r})"
+
+    @classmethod
+    def from_message(cls, message: Message) -> "MessageRecord":
+        """
+        Create a record from a pydantic message
+
+        :param message: Message to convert
+        :return: The record of the message
+        """
+        return cls(message.dict())
+
+    def get_token_count(self, model_id: str, count_tokens: Callable[[str], int]) -> int:
+        """
+        Get the number of tokens of the content, computed once per model
+
+        :param model_id: ID of the model using this record
+        :param count_tokens: Function counting the tokens of a string with the tokenizer of the model
+        :return: Number of tokens of the content, without the ones added by the chat template
+        """
+        token_count = self._token_count
+        if token_count is None or token_count[0] != model_id:
+            token_count = (model_id, count_tokens(self.content or ""))
+            object.__setattr__(self, "_token_count", token_count)
+        return token_count[1]
+
+    def to_message(self) -> Message:
+        """
+        Convert the record back to a pydantic message
+
+        :return: Message of the matching type
+        """
+        if "tool_calls" in self.data:
+            return ToolCallMessage(**self.data)
+        if self.role == MessageRoleEnum.tool:
+            return ToolResponseMessage(**self.data)
+        return Message(**self.data)
+
+
+class MessageHistory(Sequence[MessageRecord]):
+    """
+    Append-only conversation history.
+    Appending returns a new history sharing the records of the previous one instead of copying them,
+    and the previous history is left unchanged.
+    """
+    __slots__ = ("__records", "__length")
+
+    def __init__(self, records: Iterable[MessageRecord] = ()):
+        self.__records: list[MessageRecord] = list(records)
+        self.__length = len(self.__records)
+
+    @classmethod
+    def from_messages(cls, messages: Iterable[Message]) -> "MessageHistory":
+        """
+        Create a history from pydantic messages
+
+        :param messages: Messages of the conversation
+        :return: The history of the conversation
+        """
+        return cls(MessageRecord.from_message(message) for message in messages)
+
+    @classmethod
+    def __view(cls, records: list[MessageRecord], length: int) -> "MessageHistory":
+        history = cls.__new__(cls)
+        history.__records = records
+        history.__length = length
+        return history
+
+    def extend(self, records: Iterable[MessageRecord]) -> "MessageHistory":
+        """
+        Get a new history with records added at the end
+
+        :param records: Records to add
+        :return: The new history, this one is unchanged
+        """
+        if len(self.__records) != self.__length:
+            # Another history already added records after ours in the shared list, branching off
+            storage = self.__records[:self.__length]
+        else:
+            storage = self.__records
+        storage.extend(records)
+        return self.__view(storage, len(storage))
+
+    def append(self, record: MessageRecord) -> "MessageHistory":
+        """
+        Get a new history with a record added at the end
+
+        :param record: Record to add
+        :return: The new history, this one is unchanged
+        """
+        return self.extend((record,))
+
+    def dicts(self, start: int = 0) -> list[dict[str, Any]]:
+        """
+        Get the serialized messages to give to a chat template
+
+        :param start: Index of the first message to include
+        :return: List of the serialized messages, that must not be modified
+        """
+        return [record.data for record in islice(self.__records, start, self.__length)]
+
+    def __len__(self) -> int:
+        return self.__length
+
+    @overload
+    def __getitem__(self, index: int) -> MessageRecord:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[MessageRecord]:
+        ...
+
+    def __getitem__(self, index: int | slice) -> MessageRecord | list[MessageRecord]:
+        if isinstance(index, slice):
+            return self.__records[:self.__length][index]
+        if not -self.__length <= index < self.__length:
+            raise IndexError("MessageHistory index out of range")
+        return self.__records[index % self.__length]
+
+    def __iter__(self) -> Iterator[MessageRecord]:
+        return islice(self.__records, self.__length)
@@ -0,0 +1,11 @@
+from pydantic import BaseModel
+
+
+class WorkerMemoryUsage(BaseModel):
+    pid: int
+    # Resident memory, including the pages shared with the other processes
+    rss: int
+    # Proportional share of the resident memory (shared pages are split between the processes using them)
+    pss: int
+    shared: int
+    private: int
@@ -1,7 +1,8 @@
 import logging
 from abc import ABC, abstractmethod
-from typing import Literal
+from typing import Literal, Sequence
 
+from libertai_agents.history import MessageHistory
 from libertai_agents.interfaces.messages import Message, ToolCallFunction, MessageRoleEnum
 
 # Disables the error about models not available
@@ -50,7 +51,8 @@ class Model(ABC):
         tokens = self.tokenizer.tokenize(content)
         return len(tokens)
 
-    def generate_prompt(self, messages: list[Message], tools: list, system_prompt: str | None = None) -> str:
+    def generate_prompt(self, messages: Sequence[Message] | MessageHistory, tools: list,
+                        system_prompt: str | None = None) -> str:
         """
         Generate the whole chat prompt
 
@@ -59,20 +61,54 @@ class Model(ABC):
         :param tools: Available tools
         :return: Prompt string
         """
-        system_messages = [Message(role=MessageRoleEnum.system,
-                                   content=system_prompt)] if self.include_system_message and system_prompt is not None else []
-        raw_messages = list(map(lambda x: x.dict(), messages))
-
-        for i in range(len(raw_messages)):
-            included_messages: list = system_messages + raw_messages[i:]
-            prompt = self.tokenizer.apply_chat_template(conversation=included_messages, tools=tools,
-                                                        tokenize=False,
-                                                        add_generation_prompt=True)
+        history = messages if isinstance(messages, MessageHistory) else MessageHistory.from_messages(messages)
+        system_messages: list[dict] = [{"role": MessageRoleEnum.system,
+                                        "content": system_prompt}] if self.include_system_message and system_prompt is not None else []
+
+        def render(start: int) -> str | None:
+            """Render the prompt with the messages from start, returning it only if it fits in the context"""
+            prompt = self.tokenizer.apply_chat_template(conversation=system_messages + history.dicts(start),
+                                                        tools=tools, tokenize=False, add_generation_prompt=True)
             if not isinstance(prompt, str):
                 raise TypeError("Generated prompt isn't a string")
-            if self.__count_tokens(prompt) <= self.context_length:
-                return prompt
-        raise ValueError(f"Can't fit messages into the available context length ({self.context_length} tokens)")
+            return prompt if self.__count_tokens(prompt) <= self.context_length else None
+
+        # The contents alone are a lower bound of the tokens of the messages, so no earlier start can fit
+        start = len(history)
+        content_tokens = 0
+        while start > 0:
+            content_tokens += history[start - 1].get_token_count(self.model_id, self.__count_tokens)
+            if content_tokens > self.context_length:
+                break
+            start -= 1
+        if start == len(history):
+            raise ValueError(f"Can't fit messages into the available context length ({self.context_length} tokens)")
+        prompt = render(start)
+        if prompt is not None:
+            return prompt
+
+        # Finding the first start that fits by rendering a logarithmic number of prompts instead of one per message:
+        # exponential steps to find a start that fits, then a binary search between it and the last one that doesn't
+        last_message_prompt = render(len(history) - 1)
+        if last_message_prompt is None:
+            raise ValueError(f"Can't fit messages into the available context length ({self.context_length} tokens)")
+        low, high, high_prompt = start, len(history) - 1, last_message_prompt
+        step = 1
+        while low + step < high:
+            prompt = render(low + step)
+            if prompt is not None:
+                high, high_prompt = low + step, prompt
+                break
+            low += step
+            step *= 2
+        while high - low > 1:
+            middle = (low + high) // 2
+            prompt = render(middle)
+            if prompt is not None:
+                high, high_prompt = middle, prompt
+            else:
+                low = middle
+        return high_prompt
 
     def generate_tool_call_id(self) -> str | None:
         """
@@ -0,0 +1,210 @@
+import gc
+import logging
+import os
+import signal
+import socket
+import time
+
+import uvicorn
+from fastapi import FastAPI
+
+from libertai_agents.interfaces.serving import WorkerMemoryUsage
+
+logger = logging.getLogger(__name__)
+
+# Exit code of a worker that couldn't start the app (like an error in its startup event)
+WORKER_STARTUP_FAILURE_EXIT_CODE = 3
+# Workers exiting sooner than this many seconds after being spawned are restarted with an increasing delay
+MIN_WORKER_UPTIME = 10.0
+MAX_RESTART_DELAY = 30.0
+
+
+def get_worker_memory_usage(pid: int) -> WorkerMemoryUsage | None:
+    """
+    Get the memory usage of a process (Linux only)
+
+    :param pid: ID of the process
+    :return: Memory usage of the process, or None if it isn't available
+    """
+    values: dict[str, int] = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as smaps:
+            for line in smaps:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    values[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except OSError:
+        return None
+    return WorkerMemoryUsage(pid=pid, rss=values.get("Rss", 0), pss=values.get("Pss", 0),
+                             shared=values.get("Shared_Clean", 0) + values.get("Shared_Dirty", 0),
+                             private=values.get("Private_Clean", 0) + values.get("Private_Dirty", 0))
+
+
+def log_workers_memory_usage(pids: list[int]) -> None:
+    """
+    Log the memory usage of each worker
+
+    :param pids: IDs of the worker processes
+    """
+    for pid in pids:
+        usage = get_worker_memory_usage(pid)
+        if usage is None:
+            logger.info(f"Worker {pid}: memory usage unavailable")
+            continue
+        logger.info(f"Worker {pid}: RSS {usage.rss / 1024 ** 2:.1f} MB, PSS {usage.pss / 1024 ** 2:.1f} MB, "
+                    f"shared {usage.shared / 1024 ** 2:.1f} MB, private {usage.private / 1024 ** 2:.1f} MB")
+
+
+def __create_socket(host: str, port: int) -> socket.socket:
+    """Bind the listening socket in the parent so that every worker accepts connections on it"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def __spawn_worker(app: FastAPI, sock: socket.socket, log_level: str) -> int:
+    """Fork a worker serving the app, sharing the memory of the parent copy-on-write"""
+    pid = os.fork()
+    if pid != 0:
+        return pid
+
+    # Worker process, uvicorn handles SIGINT and SIGTERM with a graceful shutdown
+    exit_code = 0
+    server: uvicorn.Server | None = None
+    try:
+        for sig in [signal.SIGINT, signal.SIGTERM]:
+            signal.signal(sig, signal.SIG_DFL)
+        # Memory reports are handled by the parent, a SIGUSR1 sent to the process group mustn't kill the workers
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+        server = uvicorn.Server(uvicorn.Config(app, log_level=log_level))
+        server.run(sockets=[sock])
+    except BaseException:
+        logger.exception("Worker crashed")
+        exit_code = 1
+    finally:
+        # uvicorn returns without raising when the startup of the app fails
+        if server is None or not server.started:
+            exit_code = WORKER_STARTUP_FAILURE_EXIT_CODE
+        os._exit(exit_code)
+
+
+def serve_app(app: FastAPI, host: str, port: int, workers: int, graceful_timeout: float,
+              memory_report_interval: float | None, log_level: str) -> None:
+    """
+    Serve an app on several forked worker processes until SIGINT or SIGTERM is received.
+    Workers that exit are restarted, with an increasing delay if they keep exiting shortly after being spawned.
+
+    :param app: App to serve, everything already loaded (like tokenizers) is shared with the workers
+    :param host: Address to bind
+    :param port: Port to bind
+    :param workers: Number of worker processes
+    :param graceful_timeout: Seconds given to the workers to finish their requests when stopping
+    :param memory_report_interval: Seconds between memory usage reports of the workers (None to disable)
+    :param log_level: Log level of the workers
+    :raises RuntimeError: If a worker fails to start the app
+    """
+    if workers < 1:
+        raise ValueError("At least one worker is required")
+    if not logging.getLogger().handlers:
+        logging.basicConfig(level=logging.INFO, format="%(levelname)s:     %(message)s")
+
+    # Fast tokenizers can deadlock if their thread pool was used before forking
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    sock = __create_socket(host, port)
+
+    # Moving the objects already loaded out of the garbage collector's reach,
+    # otherwise collections in workers write to their pages and break the copy-on-write sharing
+    gc.collect()
+    gc.freeze()
+
+    stopping = False
+    report_requested = False
+
+    def request_stop(_signum, _frame) -> None:
+        nonlocal stopping
+        stopping = True
+
+    def request_report(_signum, _frame) -> None:
+        nonlocal report_requested
+        report_requested = True
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGUSR1, request_report)
+
+    pids: list[int | None] = [__spawn_worker(app, sock, log_level) for _ in range(workers)]
+    spawned_at = [time.monotonic()] * workers
+    restart_delays = [0.0] * workers
+    restart_at = [0.0] * workers
+    logger.info(f"Serving on http://{host}:{port} with {workers} workers (parent {os.getpid()}, "
+                f"send SIGUSR1 for a memory report)")
+    last_report = time.monotonic()
+
+    try:
+        while not stopping:
+            now = time.monotonic()
+            for index, pid in enumerate(pids):
+                if pid is None:
+                    if now >= restart_at[index]:
+                        pids[index] = __spawn_worker(app, sock, log_level)
+                        spawned_at[index] = now
+                    continue
+
+                finished_pid, status = os.waitpid(pid, os.WNOHANG)
+                if finished_pid == 0 or stopping:
+                    continue
+                # Replacing the worker that exited on its own
+                pids[index] = None
+                exit_code = os.waitstatus_to_exitcode(status)
+                if exit_code == WORKER_STARTUP_FAILURE_EXIT_CODE:
+                    # The app would fail the same way in a new worker
+                    raise RuntimeError(f"Worker {pid} failed to start the app")
+                if now - spawned_at[index] < MIN_WORKER_UPTIME:
+                    restart_delays[index] = min(max(restart_delays[index] * 2, 1.0), MAX_RESTART_DELAY)
+                else:
+                    restart_delays[index] = 0.0
+                restart_at[index] = now + restart_delays[index]
+                logger.warning(f"Worker {pid} exited with code {exit_code}, "
+                               f"restarting it in {restart_delays[index]:.0f}s")
+
+            if memory_report_interval is not None and now - last_report >= memory_report_interval:
+                report_requested = True
+            if report_requested:
+                report_requested = False
+                last_report = now
+                log_workers_memory_usage([pid for pid in pids if pid is not None])
+            time.sleep(0.2)
+    finally:
+        __stop_workers([pid for pid in pids if pid is not None], graceful_timeout)
+        sock.close()
+
+
+def __stop_workers(pids: list[int], graceful_timeout: float) -> None:
+    """Ask the workers to stop, and kill them if they don't in time"""
+    logger.info("Stopping workers")
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    remaining = set(pids)
+    deadline = time.monotonic() + graceful_timeout
+    while len(remaining) > 0 and time.monotonic() < deadline:
+        for pid in list(remaining):
+            try:
+                finished_pid, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                finished_pid = pid
+            if finished_pid != 0:
+                remaining.remove(pid)
+        time.sleep(0.1)
+
+    for pid in remaining:
+        logger.warning(f"Worker {pid} didn't stop in time, killing it")
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)